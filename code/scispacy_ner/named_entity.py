@@ -3,6 +3,10 @@
 
 class LinkedNamedEntity:
 
+    # Output field names, in the order of the constructor arguments
+    FIELDS = ["InputID", "InputText", "Entity", "EntityType", "UMLS.CUI", "UMLS.Label", "UMLS.Definition",
+              "UMLS.Synonyms", "UMLS.SemanticTypeIDs", "UMLS.SemanticTypeLabels", "UMLS.MappingScore"]
+
     def __init__(self, input_id, input_text, entity, entity_type, umls_cui, umls_label, umls_definition, umls_synonyms,
                  umls_semantic_type_ids, umls_semantic_type_labels, umls_mapping_score):
         self._input_id = input_id
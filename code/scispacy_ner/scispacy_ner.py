@@ -2,6 +2,7 @@
 
 import os
 import re
+import csv
 import sys
 import spacy
 import scispacy
@@ -12,132 +13,356 @@ import truecase
 import pandas as pd
 from tqdm import tqdm
 from scispacy.linking import EntityLinker
+from scispacy.file_cache import DATASET_CACHE
 from named_entity import LinkedNamedEntity
 import warnings
+import itertools
+import importlib.metadata
+import urllib.request
 import nltk
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 nltk.download('punkt')
 warnings.filterwarnings("ignore", category=UserWarning)
 warnings.filterwarnings("ignore", category=FutureWarning)
 
-__version__ = "0.8.0"
+__version__ = "0.9.0"
 
 
 class ScispacyUmlsNer:
 
-    def __init__(self, model="en_core_sci_scibert"):
+    # Pipeline components that are not needed to detect and link named entities (only doc.ents is used)
+    UNUSED_PIPES = ["tagger", "parser", "attribute_ruler", "lemmatizer"]
+
+    # Maximum number of distinct input texts whose entities are kept in memory to be reused for repeated inputs
+    DEDUP_CACHE_SIZE = 10000
+
+    # Number of threads used for truecasing. Truecasing is pure Python and holds the GIL, so more threads would only
+    # add contention; a couple are enough to overlap it with NER
+    TRUECASE_THREADS = 2
+
+    UMLS_SEMANTIC_TYPES_URL = "https://lhncbc.nlm.nih.gov/ii/tools/MetaMap/Docs/SemanticTypes_2018AB.txt"
+
+    def __init__(self, model="en_core_sci_scibert", linker_name="umls", k=30, threshold=0.7, ef_search=200):
         self._log = ScispacyUmlsNer.get_logger("scispacy.ner", logging.INFO)
 
         # Load the given scispacy model
         self._model = model
-        self._log.info(f"Loading scispaCy model {model}...")
+        self._linker_name = linker_name
+        self._log.info(f"Loading scispaCy model {model} with {linker_name} linker...")
         self._ner = spacy.load(self._model)
+        for pipe_name in ScispacyUmlsNer.UNUSED_PIPES:
+            if pipe_name in self._ner.pipe_names:
+                self._ner.disable_pipe(pipe_name)
         self._log.info("...done")
 
-        # Add UMLS linking pipe
+        self._log_nmslib_build_info()
+
+        # Add the linking pipe for the given knowledge base (see linkers()). The output fields keep their UMLS.* names
+        # whichever knowledge base is used; the smaller knowledge bases (e.g. MeSH) need far less memory and link
+        # faster than the full UMLS.
+        # k (number of nearest neighbours looked up per mention) and ef_search (size of the nmslib search's candidate
+        # list) trade linking recall for speed; lower values make linking faster. threshold (minimum score for a
+        # candidate to be kept) only filters the search results, trading recall for precision without affecting
+        # speed. The defaults are those of scispacy's EntityLinker and CandidateGenerator
         self._ner.add_pipe("scispacy_linker",
                            config={"resolve_abbreviations": True,
-                                   "linker_name": "umls",
+                                   "linker_name": linker_name,
                                    "filter_for_definitions": False,
                                    "no_definition_threshold": 0.85,
-                                   "max_entities_per_mention": 1})
+                                   "max_entities_per_mention": 1,
+                                   "k": k,
+                                   "threshold": threshold})
+        self._linker = self._ner.get_pipe("scispacy_linker")
+        self._linker.candidate_generator.ann_index.setQueryTimeParams({"efSearch": ef_search})
+        self._cui_to_entity = self._linker.kb.cui_to_entity
+
+        # Output values (label, definition, synonyms, semantic types) of the UMLS terms seen so far, keyed by CUI
+        self._cui_to_details = {}
 
-        # Load UMLS Semantic Types table
+        # Load UMLS Semantic Types table, which is downloaded once into scispacy's datasets folder and read from there
         # see https://lhncbc.nlm.nih.gov/ii/tools/MetaMap/documentation/SemanticTypesAndGroups.html
-        self._umls_semantic_types = pd.read_csv(
-            "https://lhncbc.nlm.nih.gov/ii/tools/MetaMap/Docs/SemanticTypes_2018AB.txt",
-            sep="|", names=['abbv', 'tui', 'label'])
+        umls_semantic_types = pd.read_csv(self._get_umls_semantic_types_file(),
+                                          sep="|", names=['abbv', 'tui', 'label'], usecols=['tui', 'label'])
+        self._tui_to_label = dict(zip(umls_semantic_types["tui"], umls_semantic_types["label"]))
         self._non_alphanum_re = re.compile('[\W_]+', re.UNICODE)
+        self._uuid = shortuuid.ShortUUID()
 
     @property
     def model_name(self):
         return self._model
 
-    def extract_entities(self, input_text, input_id="", incl_unlinked_entities=False, output_as_df=False):
-        if (not isinstance(input_text, str)) or input_text == "":
-            self._log.debug(f"Input text must be a non-empty string: {input_text} ({input_id})")
-            return pd.DataFrame() if output_as_df else []
-        if input_id == "":
-            input_id = shortuuid.ShortUUID().random(length=10)
-        input_text = input_text.replace("\n", " ").replace("\t", " ").replace("&nbsp;", " ")
-        clean_text = self._non_alphanum_re.sub(" ", input_text)
-        clean_text = re.sub(" +", " ", clean_text)
-        clean_text = truecase.get_true_case(clean_text)
-        entities = []
-        doc = self._ner(text=clean_text)
-        if len(doc.ents) == 0:
-            self._log.debug(f"No named entities found in text: {input_text}")
-        for entity in doc.ents:  # Extract named entities and link them to UMLS
-            linker = self._ner.get_pipe("scispacy_linker")
-            if len(entity._.kb_ents) > 0:
-                for umls_entity in entity._.kb_ents:
-                    cui, score = umls_entity
-                    score = round(score, 3)
-                    details = linker.kb.cui_to_entity[umls_entity[0]]
-                    self._add_entity_to_output(output=entities, input_id=input_id, input_text=input_text,
-                                               entity=entity.text, entity_type=entity.label_, umls_cui=cui,
-                                               umls_label=details.canonical_name, umls_semantic_types=details.types,
-                                               umls_definition=details.definition,
-                                               umls_synonyms=", ".join(details.aliases), umls_mapping_score=score)
-            else:
-                self._log.debug(f"No UMLS mappings found for entity: {input_text}")
-                if incl_unlinked_entities:
-                    self._add_entity_to_output(output=entities, input_id=input_id, input_text=input_text,
-                                               entity=entity.text, entity_type=entity.label_)
-        return self._ner_output(entities, output_as_df)
+    @property
+    def linker_name(self):
+        return self._linker_name
 
-    def extract_entities_in_list(self, string_list, output_as_df=False, incl_unlinked_entities=False):
+    def extract_entities(self, input_text, input_id="", incl_unlinked_entities=False, output_as_df=False,
+                         truecase_input=True):
+        return self._extract_entities([(input_id, input_text)], incl_unlinked_entities=incl_unlinked_entities,
+                                      output_as_df=output_as_df, truecase_input=truecase_input)
+
+    def extract_entities_in_list(self, string_list, output_as_df=False, incl_unlinked_entities=False, batch_size=64,
+                                 n_process=1, truecase_input=True):
         self._log.info(f"Processing list of {len(string_list)} strings...")
-        entities = []
-        for string in tqdm(string_list):
-            entities.extend(self.extract_entities(string, incl_unlinked_entities=incl_unlinked_entities,
-                                                  output_as_df=False))
+        inputs = (("", string) for string in tqdm(string_list))
+        entities = self._extract_entities(inputs, incl_unlinked_entities=incl_unlinked_entities,
+                                          output_as_df=output_as_df, batch_size=batch_size, n_process=n_process,
+                                          truecase_input=truecase_input)
         self._log.info(f"...done")
-        return self._ner_output(entities, output_as_df)
+        return entities
 
     def extract_entities_in_file(self, filepath, input_text_col=None, input_id_col=None, input_col_sep=None,
-                                 output_as_df=False, incl_unlinked_entities=False):
+                                 output_as_df=False, incl_unlinked_entities=False, batch_size=64, n_process=1,
+                                 truecase_input=True):
+        if input_text_col is not None:
+            return self.extract_entities_in_table(filepath, input_text_col=input_text_col, input_id_col=input_id_col,
+                                                  input_col_sep=input_col_sep, output_as_df=output_as_df,
+                                                  incl_unlinked_entities=incl_unlinked_entities,
+                                                  batch_size=batch_size, n_process=n_process,
+                                                  truecase_input=truecase_input)
+        self._log.info(f"Processing file {filepath}...")
+        entities = self._extract_entities(self._iter_file_inputs(filepath),
+                                          incl_unlinked_entities=incl_unlinked_entities, output_as_df=output_as_df,
+                                          batch_size=batch_size, n_process=n_process, truecase_input=truecase_input)
+        self._log.info(f"...done")
+        return entities
+
+    def extract_entities_in_table(self, filepath, input_text_col, input_id_col=None, input_col_sep=None,
+                                  output_as_df=False, incl_unlinked_entities=False, batch_size=64, n_process=1,
+                                  truecase_input=True):
+        self._log.info(f"Processing table {filepath}...")
+        inputs = self._iter_table_inputs(filepath, input_text_col=input_text_col, input_id_col=input_id_col,
+                                         input_col_sep=input_col_sep)
+        entities = self._extract_entities(inputs, incl_unlinked_entities=incl_unlinked_entities,
+                                          output_as_df=output_as_df, batch_size=batch_size, n_process=n_process,
+                                          truecase_input=truecase_input)
+        self._log.info(f"...done")
+        return entities
+
+    def extract_entities_to_tsv(self, filepath_in, filepath_out, input_text_col=None, input_id_col=None,
+                                input_col_sep=None, incl_unlinked_entities=False, batch_size=64, n_process=1,
+                                truecase_input=True):
+        # write each entity to the output file as soon as it is found, instead of building a data frame of them all
+        with open(filepath_out, "w", newline="") as output_file:
+            writer = csv.writer(output_file, delimiter="\t", lineterminator="\n")
+            writer.writerow(LinkedNamedEntity.FIELDS)
+            writer.writerows(self._iter_entities_in_file(filepath_in, input_text_col=input_text_col,
+                                                         input_id_col=input_id_col, input_col_sep=input_col_sep,
+                                                         incl_unlinked_entities=incl_unlinked_entities,
+                                                         batch_size=batch_size, n_process=n_process,
+                                                         truecase_input=truecase_input))
+        self._log.info(f"...wrote entities to {filepath_out}")
+
+    def iter_entities_in_file(self, filepath, input_text_col=None, input_id_col=None, input_col_sep=None,
+                              incl_unlinked_entities=False, batch_size=64, n_process=1, truecase_input=True):
+        # Yields the entities in the given file (or table, if input_text_col is given) one at a time, as
+        # LinkedNamedEntity objects
+        entities = self._iter_entities_in_file(filepath, input_text_col=input_text_col, input_id_col=input_id_col,
+                                               input_col_sep=input_col_sep,
+                                               incl_unlinked_entities=incl_unlinked_entities, batch_size=batch_size,
+                                               n_process=n_process, truecase_input=truecase_input)
+        for entity in entities:
+            yield LinkedNamedEntity(*entity)
+
+    def _iter_entities_in_file(self, filepath, input_text_col=None, input_id_col=None, input_col_sep=None,
+                               incl_unlinked_entities=False, batch_size=64, n_process=1, truecase_input=True):
+        # Same as iter_entities_in_file(), but yields entities as tuples of values in the order of
+        # LinkedNamedEntity.FIELDS, which the TSV writers output as they are
         self._log.info(f"Processing file {filepath}...")
-        entities = []
         if input_text_col is None:
-            with open(filepath, 'r') as file:
-                lines = file.readlines()
-                entities = self.extract_entities_in_list(lines, incl_unlinked_entities=incl_unlinked_entities,
-                                                         output_as_df=False)
+            inputs = self._iter_file_inputs(filepath)
         else:
-            input_table = pd.read_csv(filepath, sep=input_col_sep)
-            for index, row in tqdm(input_table.iterrows(), total=input_table.shape[0]):
-                input_text = row[input_text_col]
-                input_id = row[input_id_col]
-                if not pd.isna(input_text):
-                    entities.extend(self.extract_entities(input_text=input_text, input_id=input_id, output_as_df=False,
-                                                          incl_unlinked_entities=incl_unlinked_entities))
-        self._log.info(f"...done")
+            inputs = self._iter_table_inputs(filepath, input_text_col=input_text_col, input_id_col=input_id_col,
+                                             input_col_sep=input_col_sep)
+        yield from self._iter_entities(inputs, incl_unlinked_entities=incl_unlinked_entities, batch_size=batch_size,
+                                       n_process=n_process, truecase_input=truecase_input)
+
+    def _iter_file_inputs(self, filepath):
+        with open(filepath, 'r') as file:
+            # stream the lines of the file into the NER pipeline rather than loading the whole file in memory
+            for line in tqdm(file):
+                line = line.rstrip("\n")
+                if line:
+                    yield "", line
+
+    def _iter_table_inputs(self, filepath, input_text_col, input_id_col=None, input_col_sep=None):
+        # only parse the input text and ID columns, and read them as strings without any type inference
+        usecols = [input_text_col] + ([input_id_col] if input_id_col else [])
+        input_table = pd.read_csv(filepath, sep=input_col_sep, usecols=usecols, dtype="string", keep_default_na=True)
+        input_texts = input_table[input_text_col].tolist()
+        input_ids = input_table[input_id_col].fillna("").tolist() if input_id_col else [""] * len(input_texts)
+        for input_id, input_text in tqdm(zip(input_ids, input_texts), total=len(input_texts)):
+            if not pd.isna(input_text) and input_text:
+                yield input_id, input_text
+
+    def _extract_entities(self, inputs, incl_unlinked_entities=False, output_as_df=False, batch_size=64, n_process=1,
+                          truecase_input=True):
+        entities = self._iter_entities(inputs, incl_unlinked_entities=incl_unlinked_entities, batch_size=batch_size,
+                                       n_process=n_process, truecase_input=truecase_input)
         return self._ner_output(entities, output_as_df)
 
+    def _iter_entities(self, inputs, incl_unlinked_entities=False, batch_size=64, n_process=1, truecase_input=True):
+        # Yields entities as tuples of values in the order of LinkedNamedEntity.FIELDS.
+        # Each distinct (cleaned up) input text only goes through NER once. The entity rows found in a text, without
+        # the input ID and text, are shared by all inputs with that text. The queue holds every input in order, along
+        # with the key of its text and the list of rows to output for it, which gets filled in when that text comes
+        # out of nlp.pipe(). Inputs are output as soon as they and all inputs before them have their rows filled in
+        cached_rows = OrderedDict()
+        rows_in_flight = {}
+        queue = deque()
+        keys = itertools.count()
+
+        def iter_unique_texts():
+            cached_inputs = 0
+            for clean_text, (input_id, input_text) in self._iter_cleaned(inputs):
+                if clean_text in cached_rows:
+                    cached_rows.move_to_end(clean_text)
+                    key, rows = cached_rows[clean_text]
+                    queue.append((rows, input_id, input_text, key))
+                    # Repeated inputs do not go through nlp.pipe(), so every batch_size of them send an empty text
+                    # through it instead, which gives control back to the loop below to output the queued inputs
+                    cached_inputs += 1
+                    if cached_inputs == batch_size:
+                        cached_inputs = 0
+                        yield "", (None, None)
+                    continue
+                rows, key = [], next(keys)
+                cached_rows[clean_text] = (key, rows)
+                if len(cached_rows) > ScispacyUmlsNer.DEDUP_CACHE_SIZE:
+                    cached_rows.popitem(last=False)
+                rows_in_flight[key] = rows
+                queue.append((rows, input_id, input_text, key))
+                yield clean_text, (key, input_text)
+
+        def iter_queued_entities():
+            while queue and queue[0][3] not in rows_in_flight:
+                rows, input_id, input_text, _ = queue.popleft()
+                for row in rows:
+                    yield (input_id, input_text) + row
+
+        texts = iter_unique_texts()
+        if truecase_input:
+            texts = self._iter_truecased(texts, chunk_size=batch_size)
+        for doc, (key, input_text) in self._ner.pipe(texts, as_tuples=True, batch_size=batch_size,
+                                                     n_process=n_process):
+            if key is not None:
+                rows_in_flight.pop(key).extend(self._get_entity_rows(doc, input_text, incl_unlinked_entities))
+            yield from iter_queued_entities()
+        yield from iter_queued_entities()
+
+    def _get_entity_rows(self, doc, input_text, incl_unlinked_entities):
+        # Extract named entities and link them to UMLS. Attributes and methods used for every entity or KB candidate
+        # are bound to local names beforehand, as this runs once per (entity, candidate) pair of each distinct input
+        rows = []
+        add_row = rows.append
+        get_details = self._cui_to_details.get
+        build_details = self._get_umls_details
+        debug = self._log.debug
+        if len(doc.ents) == 0:
+            debug(f"No named entities found in text: {input_text}")
+        for entity in doc.ents:
+            entity_text, entity_type, kb_ents = entity.text, entity.label_, entity._.kb_ents
+            if kb_ents:
+                for cui, score in kb_ents:
+                    details = get_details(cui) or build_details(cui)
+                    add_row((entity_text, entity_type, cui) + details + (round(score, 3),))
+            else:
+                debug(f"No UMLS mappings found for entity: {input_text}")
+                if incl_unlinked_entities:
+                    add_row((entity_text, entity_type, "", "", "", "", "", "", ""))
+        return rows
+
+    def _iter_truecased(self, texts, chunk_size=64):
+        # Truecase the given (text, context) tuples in a thread pool, one chunk ahead of the chunk being handed to
+        # nlp.pipe(), so that truecasing the next batch of inputs overlaps with NER over the current one.
+        # The truecasing model is loaded before any thread starts, as concurrent first calls would each load their
+        # own copy of it (truecase caches it with lru_cache, which does not guard against concurrent calls)
+        truecase.get_truecaser()
+        with ThreadPoolExecutor(max_workers=min(ScispacyUmlsNer.TRUECASE_THREADS, os.cpu_count() or 1)) as executor:
+            previous_chunk = iter(())
+            while chunk := list(itertools.islice(texts, chunk_size)):
+                truecased_texts = executor.map(ScispacyUmlsNer._get_true_case, [text for text, _ in chunk])
+                yield from previous_chunk
+                previous_chunk = zip(truecased_texts, [context for _, context in chunk])
+            yield from previous_chunk
+
+    @staticmethod
+    def _get_true_case(text):
+        return truecase.get_true_case(text) if text else text
+
+    def _iter_cleaned(self, inputs):
+        # Clean up each (input_id, input_text) pair, yielding (text, context) tuples for nlp.pipe()
+        for input_id, input_text in inputs:
+            if (not isinstance(input_text, str)) or input_text == "":
+                self._log.debug(f"Input text must be a non-empty string: {input_text} ({input_id})")
+                continue
+            if input_id == "":
+                input_id = self._uuid.random(length=10)
+            input_text = input_text.replace("\n", " ").replace("\t", " ").replace("&nbsp;", " ")
+            clean_text = self._non_alphanum_re.sub(" ", input_text)
+            clean_text = re.sub(" +", " ", clean_text)
+            yield clean_text, (input_id, input_text)
+
     def _ner_output(self, entities, output_as_df):
-        return pd.DataFrame([entity.as_dict() for entity in entities]) if output_as_df else entities
+        if output_as_df:
+            # collect the values of each field in its own list, which pandas turns into columns without copying rows
+            columns = {field: [] for field in LinkedNamedEntity.FIELDS}
+            column_appends = [column.append for column in columns.values()]
+            for entity in entities:
+                for append, value in zip(column_appends, entity):
+                    append(value)
+            return pd.DataFrame(columns)
+        return [LinkedNamedEntity(*entity) for entity in entities]
+
+    def _get_umls_semantic_types_file(self):
+        filepath = os.path.join(DATASET_CACHE, os.path.basename(ScispacyUmlsNer.UMLS_SEMANTIC_TYPES_URL))
+        if not os.path.exists(filepath):
+            self._log.info(f"Downloading UMLS semantic types to {filepath}...")
+            os.makedirs(DATASET_CACHE, exist_ok=True)
+            # download to a temporary file first so that an interrupted download does not leave a partial file behind
+            urllib.request.urlretrieve(ScispacyUmlsNer.UMLS_SEMANTIC_TYPES_URL, filepath + ".part")
+            os.replace(filepath + ".part", filepath)
+        return filepath
 
-    def _add_entity_to_output(self, output, input_id, input_text, entity, entity_type, umls_cui="", umls_label="",
-                              umls_definition="", umls_semantic_types=(), umls_synonyms="", umls_mapping_score=""):
-        entity = LinkedNamedEntity(input_id=input_id, input_text=input_text, entity=entity, entity_type=entity_type,
-                                   umls_cui=umls_cui, umls_label=umls_label, umls_definition=umls_definition,
-                                   umls_synonyms=umls_synonyms, umls_semantic_type_ids=",".join(umls_semantic_types),
-                                   umls_semantic_type_labels=self._get_umls_semantic_type_labels(umls_semantic_types),
-                                   umls_mapping_score=umls_mapping_score)
-        output.append(entity)
+    def _log_nmslib_build_info(self):
+        # nmslib wheels that were not compiled for the host CPU's SIMD instructions (e.g. AVX2) make the linker's
+        # nearest neighbour search several times slower. Log the nmslib version and the CPU's SIMD instruction sets
+        # so that users can check whether they need to build nmslib from source (see the README)
+        for package in ("nmslib", "nmslib-metabrainz"):
+            try:
+                self._log.info(f"Using {package} {importlib.metadata.version(package)}")
+                break
+            except importlib.metadata.PackageNotFoundError:
+                continue
+        if os.path.exists("/proc/cpuinfo"):
+            with open("/proc/cpuinfo", 'r') as cpuinfo:
+                cpu_flags = next((line.split(":", 1)[1].split() for line in cpuinfo if line.startswith("flags")), None)
+            # only x86 CPUs list their instruction sets in a 'flags' line (e.g. aarch64 has 'Features' instead)
+            if cpu_flags is not None:
+                simd_flags = [flag for flag in ("sse4_1", "sse4_2", "avx", "avx2", "avx512f") if flag in cpu_flags]
+                self._log.info(f"CPU SIMD instruction sets: {', '.join(simd_flags) if simd_flags else 'none'}")
+
+    def _get_umls_details(self, cui):
+        # Build the output values for the UMLS term with the given CUI, which are then reused whenever the CUI recurs
+        details = self._cui_to_entity[cui]
+        self._cui_to_details[cui] = (details.canonical_name, details.definition, ", ".join(details.aliases),
+                                     ",".join(details.types), self._get_umls_semantic_type_labels(details.types))
+        return self._cui_to_details[cui]
 
     def _get_umls_semantic_type_labels(self, semantic_types):
-        semantic_type_labels = ""
-        for semantic_type in semantic_types:
-            semantic_type_labels_df = self._umls_semantic_types[self._umls_semantic_types["tui"] == semantic_type]
-            semantic_type_labels += semantic_type_labels_df["label"].item() + ","
-        return semantic_type_labels.rstrip(",")
+        # types without a known label (e.g. types of terms in knowledge bases other than UMLS) get an empty label, so
+        # that the labels still line up with the semantic type IDs
+        return ",".join(self._tui_to_label.get(semantic_type, "") for semantic_type in semantic_types)
 
     @staticmethod
     def ner_models():
         return ["en_ner_bc5cdr_md", "en_ner_jnlpba_md", "en_ner_bionlp13cg_md", "en_ner_craft_md"]
 
+    @staticmethod
+    def linkers():
+        return ["umls", "mesh", "rxnorm", "go", "hpo"]
+
     @staticmethod
     def get_logger(name, level=logging.INFO):
         formatter = logging.Formatter("%(asctime)s %(levelname)s [%(name)s]: %(message)s", "%Y-%m-%d %H:%M:%S")
@@ -151,18 +376,34 @@ class ScispacyUmlsNer:
         return logger
 
 
-def do_ner_all_models(input_file, input_text_col, input_id_col, input_col_sep):
+def do_ner_all_models(input_file, input_text_col, input_id_col, input_col_sep, linker_name="umls", batch_size=64,
+                      n_process=1):
     merged_entities_df = pd.DataFrame()
     for ner_model in ScispacyUmlsNer.ner_models():
-        scispacy_ner = ScispacyUmlsNer(model=ner_model)
+        scispacy_ner = ScispacyUmlsNer(model=ner_model, linker_name=linker_name)
         entities_df = scispacy_ner.extract_entities_in_file(filepath=input_file, output_as_df=True,
                                                             input_text_col=input_text_col, input_id_col=input_id_col,
-                                                            input_col_sep=input_col_sep)
+                                                            input_col_sep=input_col_sep, batch_size=batch_size,
+                                                            n_process=n_process)
         entities_df["ner_model"] = ner_model
         merged_entities_df = pd.concat([merged_entities_df, entities_df], ignore_index=True)
     return merged_entities_df
 
 
+def do_ner_all_models_to_tsv(input_file, output_file, input_text_col, input_id_col, input_col_sep, linker_name="umls",
+                             batch_size=64, n_process=1):
+    # same output as do_ner_all_models(), but each entity is written to the output file as soon as it is found
+    with open(output_file, "w", newline="") as output:
+        writer = csv.writer(output, delimiter="\t", lineterminator="\n")
+        writer.writerow(LinkedNamedEntity.FIELDS + ["ner_model"])
+        for ner_model in ScispacyUmlsNer.ner_models():
+            scispacy_ner = ScispacyUmlsNer(model=ner_model, linker_name=linker_name)
+            entities = scispacy_ner._iter_entities_in_file(filepath=input_file, input_text_col=input_text_col,
+                                                           input_id_col=input_id_col, input_col_sep=input_col_sep,
+                                                           batch_size=batch_size, n_process=n_process)
+            writer.writerows(entity + (ner_model,) for entity in entities)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser("scispacy_ner")
     parser.add_argument("-i", "--input", required=True, type=str, help="Input file")
@@ -170,12 +411,20 @@ if __name__ == '__main__':
     parser.add_argument("-d", "--id", type=str, help="Table column with input text IDs")
     parser.add_argument("-m", "--model", default="all", type=str,
                         help="Name of the scispaCy model to be used")
+    parser.add_argument("-l", "--linker", default="umls", type=str, choices=ScispacyUmlsNer.linkers(),
+                        help="Knowledge base that detected entities are linked to")
+    parser.add_argument("-b", "--batch-size", default=64, type=int,
+                        help="Number of input strings processed together by the spaCy pipeline")
+    parser.add_argument("-n", "--n-process", default=1, type=int,
+                        help="Number of processes used for NER. Each process holds its own copy of the linker "
+                             "(several GB of memory for UMLS)")
     args = parser.parse_args()
     input_model = args.model
     input_filepath = args.input
 
     # prepare output folder and file
-    output_dir = os.path.join("..", "..", "output", "scispacy_ner", f"model_{input_model}")
+    output_dir_name = f"model_{input_model}" if args.linker == "umls" else f"model_{input_model}_linker_{args.linker}"
+    output_dir = os.path.join("..", "..", "output", "scispacy_ner", output_dir_name)
     output_file_path = os.path.join(output_dir, input_filepath.split(os.sep)[-1] + "_entities.tsv")
     os.makedirs(output_dir, exist_ok=True)
 
@@ -186,12 +435,13 @@ if __name__ == '__main__':
         input_file_col_sep = ","
 
     if input_model.lower() == "all":
-        detected_entities = do_ner_all_models(input_file=input_filepath, input_id_col=args.id, input_text_col=args.col,
-                                              input_col_sep=input_file_col_sep)
+        do_ner_all_models_to_tsv(input_file=input_filepath, output_file=output_file_path, input_id_col=args.id,
+                                 input_text_col=args.col, input_col_sep=input_file_col_sep, linker_name=args.linker,
+                                 batch_size=args.batch_size, n_process=args.n_process)
     else:
         # instantiate scispacy with the specified model
-        my_scispacy = ScispacyUmlsNer(model=input_model)
-        detected_entities = my_scispacy.extract_entities_in_file(filepath=input_filepath, output_as_df=True,
-                                                                 input_text_col=args.col, input_id_col=args.id,
-                                                                 input_col_sep=input_file_col_sep)
-    detected_entities.to_csv(output_file_path, sep="\t", index=False)
+        my_scispacy = ScispacyUmlsNer(model=input_model, linker_name=args.linker)
+        my_scispacy.extract_entities_to_tsv(filepath_in=input_filepath, filepath_out=output_file_path,
+                                            input_text_col=args.col, input_id_col=args.id,
+                                            input_col_sep=input_file_col_sep, batch_size=args.batch_size,
+                                            n_process=args.n_process)